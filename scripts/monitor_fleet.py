@@ -15,13 +15,14 @@ Usage:
 """
 
 import argparse
-import json
+import array
 import os
+import random
 import ssl
 import sys
+import threading
 import time
-from datetime import datetime, timezone
-from collections import OrderedDict
+from datetime import datetime
 
 try:
     import paho.mqtt.client as mqtt
@@ -29,75 +30,173 @@ except ImportError:
     print("Install paho-mqtt: pip install paho-mqtt")
     sys.exit(1)
 
+# orjson decodes bytes directly in C, several times faster than stdlib
+# json on the per-message hot path; fall back to stdlib if unavailable
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
+# One TLS context for the whole process: the cert store loads once, and
+# OpenSSL can resume sessions across the monitor's many reconnects
+TLS_CONTEXT = ssl.create_default_context()
+TLS_CONTEXT.minimum_version = ssl.TLSVersion.TLSv1_2
+
 
 # ---- Device Fleet State ----
-devices = OrderedDict()
+# Struct-of-arrays layout: one parallel column per field, with
+# index[device_id] -> row number.  Numeric columns live in compact
+# array.array buffers instead of one dict per device, so a redraw is a
+# tight walk over a few flat lists rather than N heterogeneous dicts.
+# index is kept in least-recently-seen-first order (dicts preserve
+# insertion order; a re-seen device is popped and re-inserted), and
+# ids mirrors row -> device_id for evictions.
+MAX_DEVICES = 1000
+index = {}
+ids = []
+cols = {
+    "version": [],
+    "status": [],
+    "group": [],
+    "ip": [],
+    "rssi": array.array("i"),
+    "free_heap": array.array("i"),
+    "uptime_ms": array.array("q"),  # 64-bit: ms uptime overflows 'i' in ~25d
+    "last_seen_ns": array.array("q"),
+}
+COL_DEFAULTS = {
+    "version": "?", "status": "unknown", "group": "?", "ip": "?",
+    "rssi": 0, "free_heap": 0, "uptime_ms": 0, "last_seen_ns": 0,
+}
+
+# ---- Display constants (built once, not per redraw) ----
+STATUS_ICONS = {
+    "idle": "● idle",
+    "stable": "● stable",
+    "confirmed": "✓ confirmed",
+    "downloading": "↓ downloading",
+    "update_available": "↑ update avail",
+    "self_test_running": "⧖ testing",
+    "rebooting": "↻ rebooting",
+    "download_failed": "✗ dl failed",
+    "rolled_back": "⟲ rolled back",
+    "offline": "○ offline",
+}
+# Statuses a heartbeat must not overwrite (set mid-update by the device)
+PROTECTED_STATUSES = frozenset({"downloading", "self_test_running", "rebooting"})
+HEAVY_RULE = "=" * 90
+LIGHT_RULE = "-" * 90
+TABLE_HEADER = (f"{'Device':<12} {'Version':<10} {'Status':<18} {'Group':<12} "
+                f"{'RSSI':<7} {'Heap':<8} {'Uptime':<10} {'IP':<16}")
+
+# Redraw only when a visible field changed, at most REDRAW_HZ times/sec.
+# Heartbeats that change nothing on screen no longer repaint the table.
+DISPLAY_FIELDS = ("version", "status", "group", "rssi", "ip")
+REDRAW_HZ = 4
+dirty = threading.Event()
+
+# Guards index/ids/cols: on_message mutates them from the network thread
+# while redraw_loop reads them from the redraw thread
+state_lock = threading.Lock()
+
+# Reconnect backoff: 1s doubling up to 60s, so the monitor recovers from
+# a broker blip in ~1s instead of paho's default multi-second pauses.
+# The delay only resets after a session has stayed up this long, so a
+# broker that accepts and immediately drops us still gets backed off.
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+STABLE_CONNECTION_SECS = 30
+
+
+def evict_lru_device():
+    """Drop the least-recently-seen device, swapping the last row into
+    its slot so the columns stay dense (no O(n) shifting)."""
+    lru_id = next(iter(index))
+    lru_row = index.pop(lru_id)
+    last_row = len(ids) - 1
+    if lru_row != last_row:
+        moved_id = ids[last_row]
+        ids[lru_row] = moved_id
+        index[moved_id] = lru_row
+        for col in cols.values():
+            col[lru_row] = col[last_row]
+    ids.pop()
+    for col in cols.values():
+        col.pop()
 
 
 def format_time_ago(timestamp_ms):
-    """Format milliseconds uptime into human-readable string."""
-    seconds = timestamp_ms / 1000
-    if seconds < 60:
-        return f"{int(seconds)}s"
-    elif seconds < 3600:
-        return f"{int(seconds/60)}m {int(seconds%60)}s"
-    elif seconds < 86400:
-        return f"{int(seconds/3600)}h {int((seconds%3600)/60)}m"
-    else:
-        return f"{int(seconds/86400)}d {int((seconds%86400)/3600)}h"
+    """Format milliseconds uptime into human-readable string.
+
+    Integer divmod chain: each unit is divided out exactly once, no float
+    math, and it runs once per row per redraw.
+    """
+    seconds = timestamp_ms // 1000
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return f"{days}d {hours}h"
+    if hours:
+        return f"{hours}h {minutes}m"
+    if minutes:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
 
 
 def print_fleet_status():
     """Clear screen and print fleet status table."""
-    os.system('cls' if os.name == 'nt' else 'clear')
-
-    print("=" * 90)
+    # ANSI home + clear instead of os.system: no fork/exec per redraw
+    sys.stdout.write('\x1b[H\x1b[2J')
+
+    # Snapshot the rows under the lock; rendering happens outside it so
+    # on_message is never blocked on terminal I/O
+    with state_lock:
+        versions = cols["version"]
+        statuses = cols["status"]
+        groups = cols["group"]
+        ips = cols["ip"]
+        rssis = cols["rssi"]
+        heaps = cols["free_heap"]
+        uptimes = cols["uptime_ms"]
+        rows = [
+            (device_id, versions[row], statuses[row], groups[row],
+             rssis[row], heaps[row], uptimes[row], ips[row])
+            for device_id, row in index.items()
+        ]
+
+    print(HEAVY_RULE)
     print("  ESP8266 OTA Fleet Monitor")
-    print(f"  {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}  |  {len(devices)} devices online")
-    print("=" * 90)
+    print(f"  {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}  |  {len(rows)} devices online")
+    print(HEAVY_RULE)
     print()
-    print(f"{'Device':<12} {'Version':<10} {'Status':<18} {'Group':<12} "
-          f"{'RSSI':<7} {'Heap':<8} {'Uptime':<10} {'IP':<16}")
-    print("-" * 90)
-
-    for device_id, info in devices.items():
-        status = info.get("status", "unknown")
-        status_icon = {
-            "idle": "● idle",
-            "stable": "● stable",
-            "confirmed": "✓ confirmed",
-            "downloading": "↓ downloading",
-            "update_available": "↑ update avail",
-            "self_test_running": "⧖ testing",
-            "rebooting": "↻ rebooting",
-            "download_failed": "✗ dl failed",
-            "rolled_back": "⟲ rolled back",
-            "offline": "○ offline",
-        }.get(status, f"? {status}")
-
-        uptime = format_time_ago(info.get("uptime_ms", 0))
-        rssi = info.get("rssi", "?")
-        heap = info.get("free_heap", 0)
+    print(TABLE_HEADER)
+    print(LIGHT_RULE)
+
+    for device_id, version, status, group, rssi, heap, uptime_ms, ip in rows:
+        status_icon = STATUS_ICONS.get(status, f"? {status}")
+
+        uptime = format_time_ago(uptime_ms)
         heap_str = f"{heap//1024}KB" if heap else "?"
 
         print(f"{device_id:<12} "
-              f"{info.get('version', '?'):<10} "
+              f"{version:<10} "
               f"{status_icon:<18} "
-              f"{info.get('group', '?'):<12} "
-              f"{str(rssi) + 'dB':<7} "
+              f"{group:<12} "
+              f"{f'{rssi}dB' if rssi else '?':<7} "
               f"{heap_str:<8} "
               f"{uptime:<10} "
-              f"{info.get('ip', '?'):<16}")
+              f"{ip:<16}")
 
     print()
-    print("-" * 90)
+    print(LIGHT_RULE)
     print("  Press Ctrl+C to exit")
 
 
 # ---- MQTT Callbacks ----
 
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
+def on_connect(client, userdata, flags, reason_code, properties):
+    if not reason_code.is_failure:
         print("Connected to MQTT broker!")
         # Subscribe to all status and heartbeat topics
         client.subscribe("ota/status/#", qos=1)
@@ -105,42 +204,134 @@ def on_connect(client, userdata, flags, rc):
         print("Subscribed to ota/status/# and ota/heartbeat/#")
         print("Waiting for device messages...\n")
     else:
-        print(f"Connection failed: {rc}")
+        print(f"Connection failed: {reason_code}")
 
 
 def on_message(client, userdata, msg):
+    # Device identity comes from the topic (ota/status/<id>,
+    # ota/heartbeat/<id>) — cheaper than decoding JSON to find it, and a
+    # device can't claim another's row via a spoofed device_id field.
+    # Anything not matching that shape is dropped before the JSON parse.
+    parts = msg.topic.split("/")
+    if len(parts) != 3 or parts[0] != "ota" or parts[1] not in ("status", "heartbeat"):
+        return
+    device_id = parts[2]
+
     try:
-        payload = json.loads(msg.payload.decode())
-        device_id = payload.get("device_id", "unknown")
+        payload = _json.loads(msg.payload)
 
         # Merge incoming data into device state
-        if device_id not in devices:
-            devices[device_id] = {}
-
-        devices[device_id].update(payload)
-        devices[device_id]["last_seen"] = datetime.now(timezone.utc).isoformat()
-
-        # Determine status from topic type
-        if "status" in msg.topic:
-            # Status messages have an explicit status field
-            pass
-        elif "heartbeat" in msg.topic:
-            # Heartbeats indicate the device is alive
-            if devices[device_id].get("status") not in [
-                "downloading", "self_test_running", "rebooting"
-            ]:
-                state = payload.get("state", "stable")
-                devices[device_id]["status"] = state
-
-        # Refresh display
-        print_fleet_status()
-
-    except json.JSONDecodeError:
+        with state_lock:
+            row = index.get(device_id)
+            if row is None:
+                row = index[device_id] = len(index)
+                ids.append(device_id)
+                for field, col in cols.items():
+                    col.append(COL_DEFAULTS[field])
+                while len(index) > MAX_DEVICES:
+                    evict_lru_device()
+                    row = index[device_id]  # eviction may have moved our row
+            else:
+                # Pop + reinsert marks this device most-recently-seen
+                index[device_id] = index.pop(device_id)
+
+            before = tuple(cols[f][row] for f in DISPLAY_FIELDS)
+
+            for key, value in payload.items():
+                col = cols.get(key)
+                if col is None:
+                    continue
+                if isinstance(col, array.array):
+                    # Skip non-numeric junk (e.g. "rssi": "-60dBm") and
+                    # values beyond the column's range rather than letting
+                    # them abort the merge halfway through
+                    try:
+                        col[row] = int(value)
+                    except (TypeError, ValueError, OverflowError):
+                        pass
+                else:
+                    col[row] = value
+            # Plain integer stamp: no datetime/tzinfo/str allocations per
+            # message. Format with datetime.fromtimestamp(ns / 1e9) only
+            # when displayed.
+            cols["last_seen_ns"][row] = time.time_ns()
+
+            # Determine status from topic type
+            if parts[1] == "status":
+                # Status messages have an explicit status field
+                pass
+            elif parts[1] == "heartbeat":
+                # Heartbeats indicate the device is alive
+                if cols["status"][row] not in PROTECTED_STATUSES:
+                    cols["status"][row] = payload.get("state", "stable")
+
+            # Mark for redraw only if something visible actually changed
+            changed = tuple(cols[f][row] for f in DISPLAY_FIELDS) != before
+
+        if changed:
+            dirty.set()
+
+    except ValueError:
+        # Covers both json.JSONDecodeError and orjson.JSONDecodeError
         pass
     except Exception as e:
         print(f"Error processing message: {e}")
 
 
+def redraw_loop():
+    """Background thread: repaint when dirty, at most REDRAW_HZ times/sec."""
+    while True:
+        dirty.wait()
+        time.sleep(1.0 / REDRAW_HZ)  # coalesce bursts into one repaint
+        dirty.clear()
+        try:
+            print_fleet_status()
+        except Exception as e:
+            # A failed repaint must not kill the thread — the next dirty
+            # event gets another chance instead of freezing the dashboard
+            print(f"Redraw error: {e}")
+
+
+def run_network_loop(client):
+    """Drive the MQTT network loop from the calling (main) thread.
+
+    client.loop() runs one select + read/write/misc cycle here instead
+    of on loop_forever()'s dedicated network thread, so message
+    callbacks run without a per-message thread handoff. Unlike a raw
+    select on the socket, loop() also checks the SSL layer's pending()
+    buffer, so packets already decrypted but not yet processed (e.g.
+    the retained-status burst right after subscribe) are drained even
+    when no new bytes arrive on the wire. Reconnects use our own
+    jittered exponential backoff (RECONNECT_MIN_DELAY doubling up to
+    RECONNECT_MAX_DELAY, plus up to 1s of random jitter so many
+    monitors don't reconnect in lockstep after an outage); every lost
+    session backs off, and the delay resets only once a session has
+    survived STABLE_CONNECTION_SECS.
+    """
+    delay = RECONNECT_MIN_DELAY
+    while True:
+        try:
+            client.reconnect()
+        except OSError as e:
+            print(f"Connect failed: {e} — retrying in ~{delay}s")
+        else:
+            connected_at = time.monotonic()
+            try:
+                while client.loop(timeout=1.0) == mqtt.MQTT_ERR_SUCCESS:
+                    pass
+            except OSError:
+                pass
+
+            # A connect the broker immediately drops (CONNACK refusal,
+            # load shedding, ACL kick) must not count as a recovery
+            if time.monotonic() - connected_at >= STABLE_CONNECTION_SECS:
+                delay = RECONNECT_MIN_DELAY
+            print(f"Connection lost — reconnecting in ~{delay}s")
+
+        time.sleep(delay + random.uniform(0, 1))
+        delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Monitor ESP8266 OTA fleet")
     parser.add_argument("--broker", default=os.environ.get("MQTT_BROKER"))
@@ -154,7 +345,8 @@ def main():
         print("ERROR: Provide --broker or set MQTT_BROKER env var")
         sys.exit(1)
 
-    client = mqtt.Client(client_id=f"fleet-monitor-{int(time.time())}")
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2,
+                         client_id=f"fleet-monitor-{int(time.time())}")
     client.on_connect = on_connect
     client.on_message = on_message
 
@@ -162,13 +354,17 @@ def main():
         client.username_pw_set(args.username, args.password)
 
     if args.tls.lower() == "true":
-        client.tls_set(tls_version=ssl.PROTOCOL_TLSv1_2)
+        client.tls_set_context(TLS_CONTEXT)
+
+    threading.Thread(target=redraw_loop, daemon=True).start()
 
     print(f"Connecting to {args.broker}:{args.port}...")
-    client.connect(args.broker, args.port, keepalive=60)
+    # Async just records host/port; run_network_loop owns the actual
+    # connect, so a broker that's down at startup is retried not fatal
+    client.connect_async(args.broker, args.port, keepalive=60)
 
     try:
-        client.loop_forever()
+        run_network_loop(client)
     except KeyboardInterrupt:
         print("\nDisconnecting...")
         client.disconnect()
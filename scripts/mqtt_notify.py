@@ -26,21 +26,27 @@ import hashlib
 import hmac
 import json
 import os
+import socket
 import ssl
 import sys
+import threading
 import time
 from datetime import datetime, timezone
 
 import paho.mqtt.client as mqtt
 
+# One TLS context for the whole process: the cert store loads once, and
+# OpenSSL can resume sessions across reconnects while the context lives
+TLS_CONTEXT = ssl.create_default_context()
+TLS_CONTEXT.minimum_version = ssl.TLSVersion.TLSv1_2
 
-def get_env(name: str, default: str = None) -> str:
-    """Get environment variable or exit with error."""
-    val = os.environ.get(name, default)
-    if val is None:
-        print(f"ERROR: Missing environment variable: {name}")
-        sys.exit(1)
-    return val
+# Unix socket where ota_notify_daemon.py listens; when present, publishes
+# are relayed over its already-open MQTT session instead of connecting
+NOTIFY_SOCKET = "/tmp/ota-notify.sock"
+
+# QoS 1 marker published after each batch; its PUBACK confirms the broker
+# received every message queued before it on the same connection
+COMMIT_TOPIC = "ota/ci/commit"
 
 
 def build_firmware_url(repo: str, version: str) -> str:
@@ -48,22 +54,122 @@ def build_firmware_url(repo: str, version: str) -> str:
     return f"https://github.com/{repo}/releases/download/v{version}/firmware.bin"
 
 
-def compute_hmac_signature(version: str, sha256: str, url: str, signing_key: str) -> str:
+def resolve_topic(target: str) -> str:
+    """Map a target spec (group name or device:<id>) to its MQTT topic."""
+    if target.startswith("device:"):
+        return f"ota/device/{target.split(':', 1)[1]}"
+    if target == "fleet":
+        return "ota/fleet/all"
+    return f"ota/group/{target}"
+
+
+def connect_client(broker: str, port: int, username: str, password: str,
+                   use_tls: bool) -> mqtt.Client:
+    """Connect to the MQTT broker and return a connected client.
+
+    The caller is responsible for loop_stop()/disconnect() when done,
+    so one connection can be reused for multiple publishes.
+    """
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2,
+                         client_id=f"github-actions-ota-{int(time.time())}")
+    client.username_pw_set(username, password)
+
+    if use_tls:
+        client.tls_set_context(TLS_CONTEXT)
+
+    connect_evt = threading.Event()
+    connect_ok = False
+
+    def on_connect(client, userdata, flags, reason_code, properties):
+        nonlocal connect_ok
+        if not reason_code.is_failure:
+            connect_ok = True
+            print("Connected to MQTT broker!")
+        else:
+            print(f"MQTT connection failed: {reason_code}")
+        connect_evt.set()
+
+    client.on_connect = on_connect
+
+    # OSError covers DNS failures, refused connections and TLS errors —
+    # all ordinary bad-broker conditions, not worth a traceback
+    try:
+        client.connect(broker, port, keepalive=30)
+    except OSError as e:
+        print(f"ERROR: Could not connect to MQTT broker: {e}")
+        sys.exit(1)
+
+    client.loop_start()
+
+    # Wake up as soon as CONNACK arrives instead of polling once a second
+    if not connect_evt.wait(timeout=15) or not connect_ok:
+        print("ERROR: Could not connect to MQTT broker")
+        client.loop_stop()
+        sys.exit(1)
+
+    return client
+
+
+def make_base_hmac(signing_key: str) -> "hmac.HMAC":
+    """Precompute the keyed HMAC-SHA256 state for the signing key.
+
+    Each signature works from a .copy() of this object, so the ipad/opad
+    key schedule is derived once per run instead of once per signature —
+    this matters when fanning out to multiple targets in one invocation.
     """
-    Compute HMAC-SHA256 signature over the OTA payload fields.
+    return hmac.new(signing_key.encode('utf-8'), b'', hashlib.sha256)
 
-    The signature covers: version|sha256|url
+
+def compute_hmac_signature(sign_data: bytes, base_hmac) -> str:
+    """
+    Compute HMAC-SHA256 signature over pre-encoded OTA payload fields.
+
+    The signature covers: version|sha256|url (already UTF-8 encoded by
+    the caller, so repeat signing doesn't re-encode per call).
     This proves the MQTT message was created by someone with the signing key.
 
     The same computation happens on the ESP8266 to verify authenticity.
+    hashlib's OpenSSL backend already uses the CPU's SHA extensions where
+    available, so the Python-side encode/allocation is the part worth cutting.
+    """
+    h = base_hmac.copy()
+    h.update(sign_data)
+    return h.hexdigest()
+
+
+def publish_via_daemon(messages, socket_path: str = NOTIFY_SOCKET) -> bool:
+    """Relay the messages through a running ota_notify_daemon.
+
+    Sends newline-delimited JSON frames over the daemon's unix socket and
+    waits for each acknowledgement. A trailing QoS 1 commit frame gives
+    the same broker-acknowledged durability as the direct path — the
+    daemon's ack for a QoS 0 frame only means it reached the daemon's
+    TCP buffer, but it waits for the broker's PUBACK on QoS 1. Returns
+    False on any error so the caller can fall back to a direct connection.
     """
-    sign_data = f"{version}|{sha256}|{url}"
-    signature = hmac.new(
-        signing_key.encode('utf-8'),
-        sign_data.encode('utf-8'),
-        hashlib.sha256
-    ).hexdigest()
-    return signature
+    frames = list(messages) + [(COMMIT_TOPIC, b"{}", 1, False)]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(15)
+            sock.connect(socket_path)
+            with sock.makefile("rwb") as stream:
+                for msg_topic, msg_payload, qos, retain in frames:
+                    frame = json.dumps({
+                        "topic": msg_topic,
+                        "payload": msg_payload.decode('utf-8'),
+                        "qos": qos,
+                        "retain": retain,
+                    })
+                    stream.write(frame.encode('utf-8') + b"\n")
+                    stream.flush()
+                    reply = json.loads(stream.readline())
+                    if not reply.get("ok"):
+                        print(f"Daemon rejected publish: {reply.get('error', '?')}")
+                        return False
+        return True
+    except (OSError, ValueError) as e:
+        print(f"Daemon publish failed: {e}")
+        return False
 
 
 def main():
@@ -76,12 +182,20 @@ def main():
                         help="Deployment target group")
     parser.add_argument("--device", default=None,
                         help="Specific device ID (overrides --target)")
+    parser.add_argument("--extra-target", action="append", default=[],
+                        metavar="TARGET",
+                        help="Additional target to notify over the same "
+                             "connection: a group name or device:<id>. "
+                             "May be repeated.")
     parser.add_argument("--force", action="store_true",
                         help="Force update even if device is on same version")
     parser.add_argument("--dry-run", action="store_true",
                         help="Print payload without sending")
     args = parser.parse_args()
 
+    # One snapshot instead of repeated os.environ lookups
+    env = dict(os.environ)
+
     # Build the OTA notification payload
     firmware_url = build_firmware_url(args.repo, args.version)
 
@@ -95,11 +209,11 @@ def main():
     }
 
     # ---- HMAC SIGNING ----
-    signing_key = os.environ.get("OTA_SIGNING_KEY", "")
+    signing_key = env.get("OTA_SIGNING_KEY", "")
     if signing_key:
-        signature = compute_hmac_signature(
-            args.version, args.sha256, firmware_url, signing_key
-        )
+        base_hmac = make_base_hmac(signing_key)
+        sign_data = f"{args.version}|{args.sha256}|{firmware_url}".encode('utf-8')
+        signature = compute_hmac_signature(sign_data, base_hmac)
         payload["signature"] = signature
         print(f"Signature computed: {signature[:16]}...")
         print(f"  Sign data: {args.version}|{args.sha256}|{firmware_url}")
@@ -118,73 +232,80 @@ def main():
         topic = f"ota/group/{args.target}"
         print(f"Target: group -> {args.target}")
 
-    payload_json = json.dumps(payload, indent=2)
+    # Compact form for the wire (ESP8266s parse every byte over TLS),
+    # indented form only for the operator's eyes. Encoded to bytes once
+    # so paho doesn't re-encode the str per publish.
+    wire_bytes = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    display_json = json.dumps(payload, indent=2)
+
+    # All targets get the same payload, published over one connection
+    messages = [(topic, wire_bytes, 0, True)]
+    for extra in args.extra_target:
+        extra_topic = resolve_topic(extra)
+        print(f"Extra target: {extra} -> {extra_topic}")
+        messages.append((extra_topic, wire_bytes, 0, True))
 
     print(f"\nTopic:   {topic}")
-    print(f"Payload: {payload_json}")
+    print(f"Payload: {display_json}")
     print(f"URL:     {firmware_url}")
 
     if args.dry_run:
         print("\n[DRY RUN] Not sending - exiting.")
         return
 
-    # ---- Connect to MQTT and publish ----
-    broker = get_env("MQTT_BROKER")
-    port = int(get_env("MQTT_PORT", "8883"))
-    username = get_env("MQTT_USERNAME")
-    password = get_env("MQTT_PASSWORD")
-    use_tls = get_env("MQTT_USE_TLS", "true").lower() == "true"
+    def print_summary():
+        print(f"  Topics:  {', '.join(t for t, _, _, _ in messages)}")
+        print(f"  Version: {args.version}")
+        print(f"  SHA256:  {args.sha256[:16]}...")
+        if signing_key:
+            print(f"  Signed:  YES (HMAC-SHA256)")
+        else:
+            print(f"  Signed:  NO (no signing key)")
 
-    print(f"\nConnecting to MQTT broker: {broker}:{port} (TLS: {use_tls})")
+    # ---- Fast path: relay through a local long-lived daemon session ----
+    if os.path.exists(NOTIFY_SOCKET):
+        print(f"\nNotifier daemon found at {NOTIFY_SOCKET} - publishing via daemon")
+        if publish_via_daemon(messages):
+            print(f"\nOTA notification published successfully (via daemon)!")
+            print_summary()
+            return
+        print("Falling back to direct broker connection")
 
-    client = mqtt.Client(client_id=f"github-actions-ota-{int(time.time())}")
-    client.username_pw_set(username, password)
+    # ---- Connect to MQTT and publish ----
+    required = ("MQTT_BROKER", "MQTT_USERNAME", "MQTT_PASSWORD")
+    missing = [name for name in required if not env.get(name)]
+    if missing:
+        print(f"ERROR: Missing environment variable(s): {', '.join(missing)}")
+        sys.exit(1)
 
-    if use_tls:
-        client.tls_set(tls_version=ssl.PROTOCOL_TLSv1_2)
+    broker = env["MQTT_BROKER"]
+    port = int(env.get("MQTT_PORT", "8883"))
+    username = env["MQTT_USERNAME"]
+    password = env["MQTT_PASSWORD"]
+    use_tls = env.get("MQTT_USE_TLS", "true").lower() == "true"
 
-    connected = False
+    print(f"\nConnecting to MQTT broker: {broker}:{port} (TLS: {use_tls})")
 
-    def on_connect(client, userdata, flags, rc):
-        nonlocal connected
-        if rc == 0:
-            connected = True
-            print("Connected to MQTT broker!")
-        else:
-            print(f"MQTT connection failed with code: {rc}")
-
-    client.on_connect = on_connect
+    client = connect_client(broker, port, username, password, use_tls)
 
     try:
-        client.connect(broker, port, keepalive=30)
-        client.loop_start()
-
-        timeout = 15
-        for i in range(timeout):
-            if connected:
-                break
-            time.sleep(1)
-            print(f"  Waiting for connection... ({i+1}/{timeout}s)")
-
-        if not connected:
-            print("ERROR: Could not connect to MQTT broker")
+        # Queue the notifications at QoS 0, then send one QoS 1 commit
+        # marker. MQTT delivery is ordered per connection, so the commit's
+        # PUBACK means the broker already has every message before it —
+        # one acknowledged round-trip instead of one per target.
+        for msg_topic, msg_payload, qos, retain in messages:
+            client.publish(msg_topic, msg_payload, qos=qos, retain=retain)
+            print(f"Queued: {msg_topic}")
+
+        commit = client.publish(COMMIT_TOPIC, b"{}", qos=1)
+        commit.wait_for_publish(timeout=10)
+
+        if not commit.is_published():
+            print("ERROR: Batch commit not acknowledged by broker")
             sys.exit(1)
 
-        result = client.publish(topic, payload_json, qos=1, retain=True)
-        result.wait_for_publish(timeout=10)
-
-        if result.is_published():
-            print(f"\nOTA notification published successfully!")
-            print(f"  Topic:   {topic}")
-            print(f"  Version: {args.version}")
-            print(f"  SHA256:  {args.sha256[:16]}...")
-            if signing_key:
-                print(f"  Signed:  YES (HMAC-SHA256)")
-            else:
-                print(f"  Signed:  NO (no signing key)")
-        else:
-            print("ERROR: Failed to publish MQTT message")
-            sys.exit(1)
+        print(f"\nOTA notification published successfully!")
+        print_summary()
 
     except Exception as e:
         print(f"ERROR: {e}")
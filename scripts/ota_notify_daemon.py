@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+OTA Notifier Daemon — one long-lived MQTT session for local publishers.
+
+Holds a single TLS-backed MQTT connection open and relays publish
+requests received over a unix socket, so repeated notifications on the
+same host (release notify, canary promote, per-device pushes) pay the
+TLS handshake + CONNECT cost once per daemon lifetime instead of once
+per invocation. mqtt_notify.py uses the socket automatically when the
+daemon is running and falls back to a direct connection otherwise.
+
+Protocol: newline-delimited JSON frames on the socket, one per publish:
+    {"topic": "ota/fleet/all", "payload": "{...}", "qos": 1, "retain": true}
+Each frame is answered with {"ok": true} or {"ok": false, "error": "..."}.
+
+Usage:
+    python ota_notify_daemon.py
+
+Environment variables (same as mqtt_notify.py):
+    MQTT_BROKER, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD, MQTT_USE_TLS
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+from mqtt_notify import NOTIFY_SOCKET, connect_client
+
+
+def handle_connection(conn, client):
+    """Serve one local publisher: read frames, publish, acknowledge."""
+    # Connections are served one at a time, so a client that connects
+    # and then stalls must not block the accept loop forever
+    conn.settimeout(15)
+    try:
+        with conn, conn.makefile("rwb") as stream:
+            for line in stream:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    request = json.loads(line)
+                    info = client.publish(
+                        request["topic"],
+                        request["payload"],
+                        qos=request.get("qos", 1),
+                        retain=bool(request.get("retain", False)),
+                    )
+                    info.wait_for_publish(timeout=10)
+                    reply = {"ok": info.is_published()}
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+                stream.write(json.dumps(reply).encode('utf-8') + b"\n")
+                stream.flush()
+    except OSError as e:
+        print(f"Dropping client connection: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the OTA notifier daemon")
+    parser.add_argument("--socket", default=NOTIFY_SOCKET,
+                        help=f"Unix socket path to listen on (default: {NOTIFY_SOCKET})")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    required = ("MQTT_BROKER", "MQTT_USERNAME", "MQTT_PASSWORD")
+    missing = [name for name in required if not env.get(name)]
+    if missing:
+        print(f"ERROR: Missing environment variable(s): {', '.join(missing)}")
+        sys.exit(1)
+
+    broker = env["MQTT_BROKER"]
+    port = int(env.get("MQTT_PORT", "8883"))
+    username = env["MQTT_USERNAME"]
+    password = env["MQTT_PASSWORD"]
+    use_tls = env.get("MQTT_USE_TLS", "true").lower() == "true"
+
+    print(f"Connecting to MQTT broker: {broker}:{port} (TLS: {use_tls})")
+    client = connect_client(broker, port, username, password, use_tls)
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)  # stale socket from a previous daemon
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(args.socket)
+    # Owner-only: anyone who can write the socket can publish OTA
+    # notifications through our authenticated broker session
+    os.chmod(args.socket, 0o600)
+    server.listen()
+    print(f"Listening on {args.socket} - Ctrl+C to stop")
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            handle_connection(conn, client)
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+    finally:
+        server.close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        client.loop_stop()
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    main()